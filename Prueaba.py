@@ -2,45 +2,134 @@
 """
 Módulo para descargar imágenes Sentinel-2 desde Copernicus Data Space Ecosystem con interfaz gráfica
 Requiere: pip install requests tkinter geopandas shapely matplotlib rasterio
+Opcional: pip install ijson (análisis incremental de búsquedas grandes)
+Opcional: pip install aiohttp aiofiles (AsyncCopernicusDownloader)
 """
+import asyncio
+import collections
+import hashlib
+import multiprocessing
 import os
+import re
+import shutil
+import struct
+import time
 import zipfile
+import zlib
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 from datetime import datetime, timedelta
 from pathlib import Path
 import logging
+import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import lru_cache, partial
+from operator import attrgetter
+from dataclasses import dataclass, asdict
 import requests
-import geopandas as gpd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from shapely.geometry import Polygon
 import json
 from urllib.parse import urlencode
-import numpy as np
-import rasterio
-import matplotlib.pyplot as plt
-from ndvi_processor import procesar_ndvi_por_tiles
-from recorte_tlaxcala import recortar_ndvi_con_tlaxcala
-from see_ndvi import visualizar_ndvi
 from dateutil.relativedelta import relativedelta
 import calendar
 
+@dataclass(slots=True)
+class ProductInfo:
+    """Producto Sentinel-2 encontrado en el catálogo"""
+    id: str
+    title: str
+    date: str
+    cloud_cover: float
+
 class TextHandler(logging.Handler):
     """Handler para mostrar logs en la interfaz gráfica"""
+    # Intervalo entre actualizaciones del widget (ms) y máximo de líneas conservadas
+    FLUSH_INTERVAL_MS = 100
+    MAX_LINES = 5000
+
     def __init__(self, text_widget):
         super().__init__()
         self.text_widget = text_widget
+        self.buf = collections.deque()
+        self.buf_lock = threading.Lock()
+        self.pending = False
 
     def emit(self, record):
         msg = self.format(record)
-        def append():
-            self.text_widget.configure(state='normal')
-            self.text_widget.insert(tk.END, msg + '\n')
-            self.text_widget.configure(state='disabled')
-            self.text_widget.see(tk.END)
-        self.text_widget.after(0, append)
+        # Acumular mensajes y programar una sola actualización por intervalo
+        with self.buf_lock:
+            self.buf.append(msg)
+            if self.pending:
+                return
+            self.pending = True
+        self.text_widget.after(self.FLUSH_INTERVAL_MS, self._flush)
+
+    def _flush(self):
+        with self.buf_lock:
+            lines = list(self.buf)
+            self.buf.clear()
+            self.pending = False
+        if not lines:
+            return
+        self.text_widget.configure(state='normal')
+        self.text_widget.insert(tk.END, '\n'.join(lines) + '\n')
+        self.text_widget.delete('1.0', f'end-{self.MAX_LINES}l')
+        self.text_widget.configure(state='disabled')
+        self.text_widget.see(tk.END)
+
+class ProgressWriter:
+    """Envoltorio de archivo que registra el progreso de escritura cada cierto tiempo"""
+    def __init__(self, fileobj, total_size, logger, interval=2.0):
+        self.fileobj = fileobj
+        self.total_size = total_size
+        self.logger = logger
+        self.interval = interval
+        self.written = 0
+        self.last_log = time.monotonic()
+
+    def write(self, data):
+        n = self.fileobj.write(data)
+        self.update(len(data))
+        return n
+
+    def update(self, nbytes):
+        """Contabilizar bytes escritos por otra vía (p. ej. escrituras asíncronas)"""
+        self.written += nbytes
+        now = time.monotonic()
+        if self.total_size > 0 and now - self.last_log > self.interval:
+            self.last_log = now
+            progress = (self.written / self.total_size) * 100
+            self.logger.info(f"Progreso: {progress:.1f}%")
 
 class CopernicusDownloader:
+    # Bandas extraídas por defecto y patrón para localizarlas en el ZIP
+    _DEFAULT_BANDS = ('TCI', 'B08', 'B04', 'B03')
+    _BAND_RE = re.compile(r'_(TCI|B08|B04|B03)_')
+    # Tile MGRS (p. ej. T14QNG) y fecha de adquisición en el nombre del producto
+    _TILE_RE = re.compile(r'_(T\d{2}[A-Z]{3})_')
+    _DATE_RE = re.compile(r'_(\d{8})T')
+    # Vértices máximos del AOI antes de sustituirlo por su envolvente
+    MAX_AOI_VERTICES = 200
+    # Vigencia (s) de los resultados de búsqueda guardados en disco
+    SEARCH_CACHE_TTL = 6 * 3600
+    # A partir de cuántos resultados se analiza el JSON del catálogo de forma incremental
+    STREAM_MIN_RESULTS = 10
+    # Plantilla del filtro OData de búsqueda
+    _FILTER_TMPL = (
+        "Collection/Name eq 'SENTINEL-2' "
+        "and ContentDate/Start ge {s}T00:00:00.000Z "
+        "and ContentDate/Start le {e}T23:59:59.999Z "
+        "and Attributes/OData.CSC.StringAttribute/any(att:att/Name eq 'productType' and att/OData.CSC.StringAttribute/Value eq 'S2MSI2A') "
+        "and Attributes/OData.CSC.DoubleAttribute/any(att:att/Name eq 'cloudCover' and att/OData.CSC.DoubleAttribute/Value le {cc}) "
+        "and OData.CSC.Intersects(area=geography'SRID=4326;{bbox}')"
+    )
+    # Descarga por rangos: número de partes y tamaño mínimo para usarla
+    DOWNLOAD_PARTS = 4
+    MIN_RANGED_SIZE = 64 * 1024 * 1024
+
     def __init__(self, username, password, download_dir="./downloads", timeout=60):
         """
         Inicializar descargador de Copernicus Data Space Ecosystem
@@ -57,6 +146,21 @@ class CopernicusDownloader:
         self.download_dir.mkdir(exist_ok=True)
         self.timeout = timeout
         self.access_token = None
+        self.token_expiry = 0  # time.monotonic() a partir del cual hay que renovar
+        self.cache_dir = Path(".cdse_cache")
+        self.cache_dir.mkdir(exist_ok=True)
+        self._prune_search_cache()
+        # Reentrante: la renovación guarda el token (_store_token) sin soltar el bloqueo
+        self._token_lock = threading.RLock()
+        
+        # Sesión HTTP compartida: reutiliza conexiones TLS entre peticiones
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
         
         # URLs de la nueva API de Copernicus Data Space
         self.auth_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
@@ -85,302 +189,376 @@ class CopernicusDownloader:
                 "client_id": "cdse-public"
             }
             
-            response = requests.post(self.auth_url, data=data, timeout=self.timeout)
+            # Sin cabecera Authorization: un token previo no debe enviarse al servidor de identidad
+            response = self.session.post(self.auth_url, data=data, headers={"Authorization": None}, timeout=self.timeout)
             response.raise_for_status()
             
-            token_data = response.json()
-            self.access_token = token_data.get("access_token")
-            
-            if not self.access_token:
-                raise Exception("No se pudo obtener el token de acceso")
-                
-            self.logger.info("✓ Token de acceso obtenido exitosamente")
+            self._store_token(response.json())
             return True
             
         except requests.exceptions.RequestException as e:
             raise Exception(f"Error de autenticación: {str(e)}")
     
+    def _store_token(self, token_data):
+        """Guardar el token de la respuesta de autenticación y su caducidad"""
+        access_token = token_data.get("access_token")
+        
+        if not access_token:
+            raise Exception("No se pudo obtener el token de acceso")
+        
+        # Renovar 30 s antes de que caduque según el servidor
+        expires_in = int(token_data.get("expires_in", 600))
+        
+        # Los hilos de descarga comparten el token
+        with self._token_lock:
+            self.access_token = access_token
+            self.token_expiry = time.monotonic() + expires_in - 30
+            self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+            
+        self.logger.info("✓ Token de acceso obtenido exitosamente")
+    
+    def renovar_token_si_necesario(self):
+        """Obtener un token nuevo solo si no hay uno o está por caducar"""
+        # Comprobación y renovación bajo el mismo bloqueo: cuando el token caduca,
+        # solo el primer hilo de descarga pide uno nuevo y el resto lo reutiliza
+        with self._token_lock:
+            if not self.access_token:
+                self.get_access_token()
+            elif time.monotonic() >= self.token_expiry:
+                self.logger.info("Token expirado. Renovando...")
+                self.get_access_token()
+    
+    def _renovar_token_rechazado(self, rejected_token):
+        """Renovar tras un 401, salvo que otro hilo ya haya sustituido ese token"""
+        with self._token_lock:
+            if self.access_token == rejected_token:
+                self.logger.info("Token rechazado por el servidor. Renovando...")
+                self.get_access_token()
+    
     def create_aoi_from_shapefile(self, shapefile_path):
         """Crear área de interés desde shapefile"""
+        import geopandas as gpd
         try:
             gdf = gpd.read_file(shapefile_path)
             if gdf.crs != 'EPSG:4326':
                 gdf = gdf.to_crs('EPSG:4326')
-            geometry = gdf.geometry.unary_union
+            if hasattr(gdf.geometry, 'union_all'):
+                geometry = gdf.geometry.union_all()
+            else:
+                geometry = gdf.geometry.unary_union
+            
+            # La consulta solo usa la envolvente; simplificar geometrías con muchos vértices
+            if self._count_vertices(geometry) > self.MAX_AOI_VERTICES:
+                geometry = geometry.envelope
             return geometry
         except Exception as e:
             self.logger.warning(f"No se pudo cargar shapefile: {e}. Usando bounds por defecto.")
             return self.tlaxcala_bounds
     
+    @staticmethod
+    def _count_vertices(geometry):
+        """Número de vértices exteriores de un Polygon o MultiPolygon"""
+        if hasattr(geometry, 'exterior'):
+            return len(geometry.exterior.coords)
+        return sum(len(g.exterior.coords) for g in getattr(geometry, 'geoms', ()) if hasattr(g, 'exterior'))
+    
     def polygon_to_wkt(self, polygon):
         """Convertir polígono a formato WKT para la consulta"""
         coords = list(polygon.exterior.coords)
         wkt_coords = [f"{lon} {lat}" for lon, lat in coords]
         return f"POLYGON(({','.join(wkt_coords)}))"
     
-    def search_sentinel2_products(self, start_date, end_date, aoi=None, max_cloud_cover=20, max_results=50):
+    def search_sentinel2_products(self, start_date, end_date, aoi=None, max_cloud_cover=20, max_results=50, use_cache=True):
         """Buscar productos Sentinel-2 usando la nueva API"""
         if aoi is None:
             aoi = self.tlaxcala_bounds
         
+        # Reutilizar resultados recientes de la misma consulta
+        cache_path = None
+        if use_cache:
+            cache_path = self._search_cache_path(start_date, end_date, aoi.bounds, max_cloud_cover, max_results)
+            cached = self._load_search_cache(cache_path)
+            if cached is not None:
+                return cached
+        
         # Asegurar que tenemos token de acceso
-        if not self.access_token:
-            self.get_access_token()
+        self.renovar_token_si_necesario()
+        
+        params = self._build_search_params(start_date, end_date, aoi.bounds, max_cloud_cover, max_results)
         
-        bounds = aoi.bounds
+        try:
+            # Respuestas grandes se procesan a medida que llegan (ver _iter_catalog_products)
+            streaming = max_results > self.STREAM_MIN_RESULTS
+            
+            # Respuesta comprimida: el JSON del catálogo puede ocupar varios MB
+            with self.session.get(
+                self.catalog_url, params=params, stream=streaming,
+                headers={"Accept-Encoding": "gzip, deflate"}, timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                
+                # Convertir a formato más amigable
+                products_list = [self._parse_product(product)
+                                 for product in self._iter_catalog_products(response, streaming)]
+            
+            return self._finish_search(products_list, cache_path)
+            
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error al buscar productos: {str(e)}")
+    
+    def _search_cache_path(self, start_date, end_date, bounds, max_cloud_cover, max_results):
+        """Ruta del archivo de caché para una consulta de búsqueda"""
+        cache_key = hashlib.sha1(json.dumps(
+            [start_date.isoformat(), end_date.isoformat(), list(bounds), max_cloud_cover, max_results],
+            sort_keys=True
+        ).encode()).hexdigest()
+        return self.cache_dir / f"{cache_key}.json"
+    
+    def _prune_search_cache(self):
+        """Borrar las entradas de la caché de búsqueda que ya superaron SEARCH_CACHE_TTL"""
+        limite = time.time() - self.SEARCH_CACHE_TTL
+        for cache_path in self.cache_dir.glob("*.json"):
+            try:
+                if cache_path.stat().st_mtime < limite:
+                    cache_path.unlink()
+            except OSError:
+                pass
+    
+    def _load_search_cache(self, cache_path):
+        """Productos guardados para la consulta, o None si no hay caché vigente"""
+        if cache_path.exists() and time.time() - cache_path.stat().st_mtime < self.SEARCH_CACHE_TTL:
+            try:
+                products_list = [ProductInfo(**d) for d in json.loads(cache_path.read_text())]
+                self.logger.info(f"Usando {len(products_list)} productos de la caché de búsqueda")
+                return products_list
+            except (OSError, ValueError, TypeError) as e:
+                self.logger.warning(f"No se pudo leer la caché de búsqueda: {e}")
+        return None
+    
+    def _build_search_params(self, start_date, end_date, bounds, max_cloud_cover, max_results):
+        """Parámetros OData de la consulta al catálogo"""
         bbox_wkt = f"POLYGON(({bounds[0]} {bounds[1]},{bounds[2]} {bounds[1]},{bounds[2]} {bounds[3]},{bounds[0]} {bounds[3]},{bounds[0]} {bounds[1]}))"
         
         self.logger.info(f"Buscando productos Sentinel-2 del {start_date.strftime('%Y-%m-%d')} al {end_date.strftime('%Y-%m-%d')}")
         self.logger.info(f"Cobertura de nubes máxima: {max_cloud_cover}%")
         
         # Construir filtro de búsqueda para la nueva API
-        filter_query = (
-            f"Collection/Name eq 'SENTINEL-2' "
-            f"and ContentDate/Start ge {start_date.strftime('%Y-%m-%d')}T00:00:00.000Z "
-            f"and ContentDate/Start le {end_date.strftime('%Y-%m-%d')}T23:59:59.999Z "
-            f"and Attributes/OData.CSC.StringAttribute/any(att:att/Name eq 'productType' and att/OData.CSC.StringAttribute/Value eq 'S2MSI2A') "
-            f"and Attributes/OData.CSC.DoubleAttribute/any(att:att/Name eq 'cloudCover' and att/OData.CSC.DoubleAttribute/Value le {max_cloud_cover}) "
-            f"and OData.CSC.Intersects(area=geography'SRID=4326;{bbox_wkt}')"
+        filter_query = self._FILTER_TMPL.format(
+            s=start_date.strftime('%Y-%m-%d'),
+            e=end_date.strftime('%Y-%m-%d'),
+            cc=max_cloud_cover,
+            bbox=bbox_wkt
         )
         
-        params = {
+        return {
             "$filter": filter_query,
             "$orderby": "ContentDate/Start desc",
             "$top": max_results
         }
+    
+    @staticmethod
+    def _parse_product(product):
+        """Convertir un producto del catálogo a ProductInfo"""
+        # Indexar atributos por nombre: búsquedas O(1) (cobertura de nubes por defecto: 0)
+        attrs = {a.get('Name'): a for a in product.get('Attributes', ())}
+        cc_attr = attrs.get('cloudCover')
+        return ProductInfo(
+            product['Id'],
+            product['Name'],
+            product['ContentDate']['Start'][:10],
+            float(cc_attr.get('Value', 0)) if cc_attr else 0.0
+        )
+    
+    def _finish_search(self, products_list, cache_path):
+        """Registrar, ordenar y guardar en caché los productos encontrados"""
+        self.logger.info(f"Encontrados {len(products_list)} productos")
         
-        headers = {
-            "Authorization": f"Bearer {self.access_token}"
-        }
+        if products_list:
+            self.logger.info("\n".join(
+                f"  {p.title} - Fecha: {p.date} - Nubes: {p.cloud_cover:.1f}%"
+                for p in products_list
+            ))
         
-        try:
-            response = requests.get(self.catalog_url, params=params, headers=headers, timeout=self.timeout)
-            response.raise_for_status()
-            
-            products_data = response.json()
-            products = products_data.get("value", [])
-            
-            self.logger.info(f"Encontrados {len(products)} productos")
-            
-            # Convertir a formato más amigable
-            products_list = []
-            for product in products:
-                # Extraer información relevante
-                product_info = {
-                    'id': product['Id'],
-                    'title': product['Name'],
-                    'date': product['ContentDate']['Start'][:10],
-                    'cloud_cover': 0  # Valor por defecto
-                }
-                
-                # Buscar cobertura de nubes en los atributos
-                for attr in product.get('Attributes', []):
-                    if attr.get('Name') == 'cloudCover':
-                        product_info['cloud_cover'] = float(attr.get('Value', 0))
-                        break
-                
-                products_list.append(product_info)
-                self.logger.info(f"  {product_info['title']} - Fecha: {product_info['date']} - Nubes: {product_info['cloud_cover']:.1f}%")
-            
-            # Ordenar por fecha y cobertura de nubes
-            products_list.sort(key=lambda x: (x['date'], x['cloud_cover']), reverse=True)
-            
-            return products_list
-            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error al buscar productos: {str(e)}")
+        # Ordenar por fecha y cobertura de nubes
+        products_list.sort(key=attrgetter('date', 'cloud_cover'), reverse=True)
+        
+        if cache_path is not None:
+            try:
+                cache_path.write_text(json.dumps([asdict(p) for p in products_list]))
+            except OSError as e:
+                self.logger.warning(f"No se pudo guardar la caché de búsqueda: {e}")
+        
+        return products_list
+    
+    @staticmethod
+    def _iter_catalog_products(response, streaming):
+        """Iterar los productos de la respuesta del catálogo, con ijson si está disponible"""
+        if streaming:
+            try:
+                import ijson
+            except ImportError:
+                ijson = None
+            if ijson is not None:
+                response.raw.decode_content = True
+                return ijson.items(response.raw, 'value.item')
+        return response.json().get("value", [])
     
     def download_product(self, product_id, product_title):
         """Descargar un producto específico con renovación de token si es necesario"""
 
-        def renovar_token_si_necesario():
-            try:
-                headers = {"Authorization": f"Bearer {self.access_token}"}
-                test_url = f"{self.download_url}({product_id})"
-                test_response = requests.head(test_url, headers=headers, timeout=self.timeout)
-                if test_response.status_code == 401:
-                    self.logger.info("Token expirado. Renovando...")
-                    self.get_access_token()
-            except Exception as e:
-                self.logger.warning(f"No se pudo verificar el token: {e}. Renovando por seguridad.")
-                self.get_access_token()
-
         # Verificar token antes de la descarga
-        if not self.access_token:
-            self.get_access_token()
-        else:
-            renovar_token_si_necesario()
+        self.renovar_token_si_necesario()
 
         download_endpoint = f"{self.download_url}({product_id})/$value"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}"
-        }
+        filepath, part_path = self._download_paths(product_title)
 
-        filename = f"{product_title}.zip"
-        filepath = self.download_dir / filename
+        # Consultar tamaño remoto y soporte de rangos antes de descargar
+        remote_size = -1
+        accepts_ranges = False
+        try:
+            head = self.session.head(download_endpoint, timeout=self.timeout, allow_redirects=True)
+            head.raise_for_status()
+            remote_size = int(head.headers.get('Content-Length', -1))
+            accepts_ranges = head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.warning(f"No se pudo consultar el tamaño de {filepath.name}: {e}")
+
+        if self._is_complete(filepath, remote_size):
+            return str(filepath)
 
         self.logger.info(f"Descargando: {product_title}")
 
         try:
-            with requests.get(download_endpoint, headers=headers, stream=True, timeout=self.timeout) as response:
-                response.raise_for_status()
-                total_size = int(response.headers.get('content-length', 0))
-
-                with open(filepath, 'wb') as f:
-                    downloaded = 0
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            if total_size > 0 and downloaded % (1024 * 1024) == 0:
-                                progress = (downloaded / total_size) * 100
-                                self.logger.info(f"Progreso: {progress:.1f}%")
+            if accepts_ranges and remote_size >= self.MIN_RANGED_SIZE:
+                self._download_in_parts(download_endpoint, part_path, remote_size)
+            else:
+                with self._get_with_token_retry(download_endpoint, stream=True) as response:
+                    response.raise_for_status()
+                    total_size = int(response.headers.get('content-length', 0))
+
+                    # Copia en bloques de 1 MiB desde el socket al archivo
+                    response.raw.decode_content = True
+                    with open(part_path, 'wb') as f:
+                        if total_size > 0:
+                            self._preallocate(f, total_size)
+                        shutil.copyfileobj(response.raw, ProgressWriter(f, total_size, self.logger), length=1 << 20)
+                        # Descartar espacio reservado sobrante si se recibieron menos bytes
+                        f.truncate(f.tell())
 
+            # Solo una descarga completa recibe el nombre final
+            os.replace(part_path, filepath)
             self.logger.info(f"Descarga completada: {filepath}")
             return str(filepath)
 
         except Exception as e:
             self.logger.error(f"Error descargando {product_title}: {e}")
-            if filepath.exists():
-                filepath.unlink()  # Eliminar archivo incompleto
+            if part_path.exists():
+                part_path.unlink()  # Eliminar archivo incompleto
             raise
     
+    def _download_paths(self, product_title):
+        """
+        Ruta final del ZIP y ruta temporal .part. Se descarga en .part y se renombra
+        al terminar: un archivo con el nombre final siempre está completo.
+        """
+        filepath = self.download_dir / f"{product_title}.zip"
+        return filepath, filepath.with_name(f"{filepath.name}.part")
+
+    def _is_complete(self, filepath, remote_size):
+        """True si el ZIP final ya existe con el tamaño remoto (la descarga se omite)"""
+        if remote_size > 0 and filepath.exists() and filepath.stat().st_size == remote_size:
+            self.logger.info(f"Ya existe y coincide tamaño: {filepath.name}")
+            return True
+        return False
+
+    def _part_ranges(self, total_size):
+        """(desplazamiento, longitud) de cada parte de una descarga por rangos"""
+        part_size = -(-total_size // self.DOWNLOAD_PARTS)
+        return [(offset, min(part_size, total_size - offset))
+                for offset in range(0, total_size, part_size)]
+
+    def _get_with_token_retry(self, url, **kwargs):
+        """GET que renueva el token y reintenta una vez si el servidor responde 401"""
+        token = self.access_token
+        response = self.session.get(url, timeout=self.timeout, **kwargs)
+        if response.status_code == 401:
+            response.close()
+            self._renovar_token_rechazado(token)
+            response = self.session.get(url, timeout=self.timeout, **kwargs)
+        return response
+
+    @staticmethod
+    def _preallocate(f, total_size):
+        """Reservar espacio contiguo para el archivo e indicar acceso secuencial"""
+        try:
+            os.posix_fallocate(f.fileno(), 0, total_size)
+            os.posix_fadvise(f.fileno(), 0, total_size, os.POSIX_FADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            # Windows/macOS: extender el archivo (equivale a SetEndOfFile)
+            f.truncate(total_size)
+
+    def _download_in_parts(self, url, filepath, total_size):
+        """Descargar un archivo en varias partes paralelas usando peticiones Range"""
+        # Reservar el tamaño final para que cada parte escriba en su desplazamiento
+        with open(filepath, 'wb') as f:
+            self._preallocate(f, total_size)
+
+        ranges = self._part_ranges(total_size)
+        # Se activa cuando una parte falla: las demás dejan de descargar
+        abortar = threading.Event()
+
+        def fetch(offset, length):
+            headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+            with self._get_with_token_retry(url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise Exception(f"El servidor ignoró la petición de rango (HTTP {response.status_code})")
+                response.raw.decode_content = True
+                # Cada hilo usa su propio descriptor y escribe solo en su región
+                with open(filepath, 'r+b') as f:
+                    f.seek(offset)
+                    while not abortar.is_set():
+                        chunk = response.raw.read(1 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(fetch, offset, length) for offset, length in ranges]
+            try:
+                for i, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    self.logger.info(f"Progreso: {i}/{len(ranges)} partes de {filepath.name}")
+            except BaseException:
+                # Al primer fallo: cancelar las partes pendientes y detener las que corren
+                abortar.set()
+                executor.shutdown(cancel_futures=True)
+                raise
+
     def extract_and_organize_bands(self, zip_files, target_bands=['TCI', 'B08', 'B04', 'B03']):
         """Extraer y organizar bandas específicas - VERSIÓN MEJORADA para Windows"""
         organized_bands = {}
+        if not zip_files:
+            return organized_bands
         
-        for zip_file in zip_files:
-            self.logger.info(f"Extrayendo bandas de: {zip_file}")
-            
-            # Crear directorio de extracción con nombre más corto para evitar problemas de ruta larga
-            zip_path = Path(zip_file)
-            # Usar solo el tile ID y fecha para el directorio
-            safe_name = zip_path.stem
-            tile_part = None
-            date_part = None
-            
-            # Extraer partes importantes del nombre
-            parts = safe_name.split('_')
-            for part in parts:
-                if part.startswith('T') and len(part) == 6:
-                    tile_part = part
-                elif len(part) >= 8 and part.startswith('2'):
-                    date_part = part[:8]
-            
-            # Crear nombre corto para el directorio
-            if tile_part and date_part:
-                short_name = f"{tile_part}_{date_part}"
-            else:
-                short_name = safe_name[:50]  # Truncar si es muy largo
-            
-            extract_dir = self.download_dir / short_name
-            
-            # Limpiar directorio si existe
-            if extract_dir.exists():
-                import shutil
-                try:
-                    shutil.rmtree(extract_dir)
-                except OSError as e:
-                    self.logger.warning(f"No se pudo limpiar directorio existente: {e}")
-            
-            extract_dir.mkdir(exist_ok=True)
-            
-            try:
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    file_list = zip_ref.namelist()
-                    
-                    # Contar archivos de bandas objetivo
-                    band_count = 0
-                    for f in file_list:
-                        if f.endswith('.jp2'):
-                            for band in target_bands:
-                                if f"_{band}_" in f:
-                                    band_count += 1
-                                    break
-                    
-                    self.logger.info(f"  Archivos de bandas objetivo encontrados: {band_count}")
-                    
-                    # Extraer solo los archivos necesarios para evitar problemas de ruta larga
-                    band_files = {}
-                    extracted_files = []
-                    
-                    for file_path in file_list:
-                        if file_path.endswith('.jp2'):
-                            # Verificar si es una banda objetivo
-                            for band in target_bands:
-                                if f"_{band}_" in file_path:
-                                    try:
-                                        # Extraer archivo individual
-                                        zip_ref.extract(file_path, extract_dir)
-                                        
-                                        # Construir ruta completa del archivo extraído
-                                        extracted_file_path = extract_dir / file_path
-                                        
-                                        if extracted_file_path.exists():
-                                            band_files[band] = str(extracted_file_path.resolve())
-                                            extracted_files.append(str(extracted_file_path))
-                                            
-                                            # Obtener solo el nombre del archivo para el log
-                                            file_name = Path(file_path).name
-                                            self.logger.info(f"  ✓ Extraída banda {band}: {file_name}")
-                                        else:
-                                            self.logger.warning(f"  ✗ No se pudo extraer banda {band}: {file_path}")
-                                            
-                                    except Exception as extract_error:
-                                        self.logger.error(f"  ✗ Error extrayendo {file_path}: {extract_error}")
-                                        continue
-                                    break
-                    
-                    # Si se encontraron bandas, organizar por tile
-                    if band_files:
-                        product_name = safe_name
-                        tile_id = self._extract_tile_id(product_name)
-                        
-                        if tile_id:
-                            organized_bands[tile_id] = {
-                                'date': self._extract_date(product_name),
-                                'bands': band_files,
-                                'product_name': product_name,
-                                'extract_dir': str(extract_dir),
-                                'extracted_files': extracted_files
-                            }
-                            self.logger.info(f"  ✓ Procesado tile {tile_id} con {len(band_files)} bandas: {list(band_files.keys())}")
-                        else:
-                            self.logger.warning(f"  ✗ No se pudo extraer tile ID de: {product_name}")
-                    else:
-                        self.logger.warning(f"  ✗ No se encontraron bandas objetivo en: {zip_path.name}")
-                        
-                        # Debug: mostrar archivos JP2 disponibles
-                        jp2_files = [f for f in file_list if f.endswith('.jp2')]
-                        self.logger.info(f"  Archivos JP2 disponibles en ZIP: {len(jp2_files)}")
-                        
-                        # Mostrar algunos ejemplos
-                        for jp2_file in jp2_files[:5]:
-                            file_name = Path(jp2_file).name
-                            self.logger.info(f"    {file_name}")
-                        
-                        if len(jp2_files) > 5:
-                            self.logger.info(f"    ... y {len(jp2_files) - 5} archivos más")
-            
-            except zipfile.BadZipFile:
-                self.logger.error(f"Archivo ZIP corrupto: {zip_file}")
-                continue
-            except PermissionError as e:
-                self.logger.error(f"Error de permisos extrayendo {zip_file}: {e}")
-                continue
-            except Exception as e:
-                self.logger.error(f"Error general extrayendo {zip_file}: {e}")
-                self.logger.error(f"Tipo de error: {type(e).__name__}")
-                
-                # Información adicional para debugging
-                if "path too long" in str(e).lower() or len(str(extract_dir)) > 200:
-                    self.logger.error("Problema con rutas largas detectado.")
-                    self.logger.error(f"Longitud de ruta base: {len(str(extract_dir))} caracteres")
-                    self.logger.error("Soluciones:")
-                    self.logger.error("1. Mover los archivos a C:\\temp o similar")
-                    self.logger.error("2. Usar un directorio de descarga más corto")
-                
-                continue
+        # Cada ZIP es independiente: se extraen en procesos separados y los
+        # mensajes de log se emiten aquí, en el proceso principal
+        extract_one = partial(
+            _extract_one_zip,
+            download_dir_str=str(self.download_dir),
+            target_bands=tuple(target_bands)
+        )
+        # 'spawn': este proceso puede tener ya la capa de hilos de Numba en marcha y
+        # hacer fork con ella activa no es seguro
+        with ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(zip_files)),
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            for tile_id, data, logs in executor.map(extract_one, zip_files):
+                for level, msg in logs:
+                    self.logger.log(level, msg)
+                if tile_id:
+                    organized_bands[tile_id] = data
         
         return organized_bands
 
@@ -390,30 +568,28 @@ class CopernicusDownloader:
         for tile_id, data in organized_bands.items():
             extract_dir = Path(data.get('extract_dir', ''))
             if extract_dir.exists():
-                import shutil
                 try:
                     shutil.rmtree(extract_dir)
                     self.logger.info(f"Limpiado directorio temporal: {extract_dir}")
                 except Exception as e:
                     self.logger.warning(f"No se pudo limpiar {extract_dir}: {e}")
 
-    def _extract_tile_id(self, product_name):
-        """Extraer tile ID del nombre del producto"""
-        parts = product_name.split('_')
-        for part in parts:
-            if part.startswith('T') and len(part) == 6:
-                return part
-        return None
+    @classmethod
+    def _parse_product_name(cls, product_name):
+        """Extraer tile ID y fecha (YYYYMMDD) del nombre del producto"""
+        tile_match = cls._TILE_RE.search(product_name)
+        date_match = cls._DATE_RE.search(product_name)
+        return (tile_match.group(1) if tile_match else None,
+                date_match.group(1) if date_match else None)
     
-    def _extract_date(self, product_name):
-        """Extraer fecha del nombre del producto"""
-        parts = product_name.split('_')
-        for part in parts:
-            if len(part) >= 8 and part.startswith('2'):
-                try:
-                    return datetime.strptime(part[:8], '%Y%m%d')
-                except:
-                    continue
+    @staticmethod
+    def _parse_date(date_part):
+        """Convertir fecha YYYYMMDD a datetime (fecha actual si no es válida)"""
+        if date_part:
+            try:
+                return datetime.strptime(date_part, '%Y%m%d')
+            except ValueError:
+                pass
         return datetime.now()
     
     def test_connection(self):
@@ -432,7 +608,8 @@ class CopernicusDownloader:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=7)
             
-            products = self.search_sentinel2_products(start_date, end_date, small_area, max_results=1)
+            # Sin caché: la prueba debe consultar realmente el catálogo
+            products = self.search_sentinel2_products(start_date, end_date, small_area, max_results=1, use_cache=False)
             
             self.logger.info(f"✓ Conexión exitosa con Copernicus Data Space")
             self.logger.info(f"✓ Productos encontrados en consulta de prueba: {len(products)}")
@@ -447,8 +624,8 @@ class CopernicusDownloader:
     def download_for_period(self, start_date, end_date, shapefile_path=None, max_cloud_cover=20, max_products=5):
         """Descargar imágenes para un período específico"""
         try:
-            # Autenticar primero
-            self.get_access_token()
+            # Autenticar primero (reutiliza el token vigente, p. ej. tras probar la conexión)
+            self.renovar_token_si_necesario()
             
             aoi = None
             if shapefile_path:
@@ -461,15 +638,20 @@ class CopernicusDownloader:
                 return {}
             
             downloaded_files = []
+            selected = products[:max_products]
             
-            # Descargar los productos seleccionados
-            for i, product in enumerate(products[:max_products]):
-                try:
-                    downloaded_file = self.download_product(product['id'], product['title'])
-                    downloaded_files.append(downloaded_file)
-                except Exception as e:
-                    self.logger.error(f"Error descargando producto {i+1}: {e}")
-                    continue
+            # Descargar los productos seleccionados en paralelo (trabajo limitado por red)
+            with ThreadPoolExecutor(max_workers=min(8, len(selected))) as executor:
+                futures = {
+                    executor.submit(self.download_product, product.id, product.title): i
+                    for i, product in enumerate(selected)
+                }
+                for future in as_completed(futures):
+                    try:
+                        downloaded_files.append(future.result())
+                    except Exception as e:
+                        self.logger.error(f"Error descargando producto {futures[future]+1}: {e}")
+                        continue
             
             if not downloaded_files:
                 self.logger.warning("No se pudieron descargar productos")
@@ -482,6 +664,398 @@ class CopernicusDownloader:
             self.logger.error(f"Error en download_for_period: {e}")
             raise
 
+@lru_cache(maxsize=None)
+def _band_pattern(target_bands):
+    """Patrón que localiza las bandas objetivo en los nombres de archivo del ZIP"""
+    if target_bands == CopernicusDownloader._DEFAULT_BANDS:
+        return CopernicusDownloader._BAND_RE
+    return re.compile('_(' + '|'.join(map(re.escape, target_bands)) + ')_')
+
+def _copy_zip_member(zip_ref, raw_zip, info, out_path):
+    """
+    Copiar un miembro del ZIP a out_path
+    
+    Los JP2 suelen guardarse sin compresión (ZIP_STORED); en ese caso los datos
+    se copian con os.sendfile directamente entre descriptores, sin pasar por
+    Python, y después se comprueba el CRC-32 como haría zip_ref.open. En otro
+    caso (o si sendfile no está disponible) se usa zip_ref.open.
+    """
+    if (hasattr(os, 'sendfile') and info.compress_type == zipfile.ZIP_STORED
+            and not info.flag_bits & 0x1):
+        # Cabecera local: 30 bytes fijos + nombre + campo extra, luego los datos
+        raw_zip.seek(info.header_offset)
+        header = raw_zip.read(30)
+        if header[:4] == b'PK\x03\x04':
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            data_offset = info.header_offset + 30 + name_len + extra_len
+            try:
+                with open(out_path, 'w+b') as dst:
+                    sent = 0
+                    while sent < info.file_size:
+                        n = os.sendfile(dst.fileno(), raw_zip.fileno(), data_offset + sent, info.file_size - sent)
+                        if n == 0:
+                            raise EOFError(f"ZIP truncado: {info.filename}")
+                        sent += n
+                    # sendfile copia en bruto: verificar el CRC de lo escrito (está en caché de páginas)
+                    dst.seek(0)
+                    crc = 0
+                    while chunk := dst.read(1 << 20):
+                        crc = zlib.crc32(chunk, crc)
+                if crc != info.CRC:
+                    os.unlink(out_path)
+                    raise zipfile.BadZipFile(f"CRC-32 incorrecto en {info.filename}")
+                return
+            except OSError:
+                pass  # p. ej. macOS solo admite sockets como destino
+    
+    with zip_ref.open(info) as src, open(out_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+def _extract_one_zip(zip_file, download_dir_str, target_bands):
+    """
+    Extraer las bandas objetivo de un ZIP (se ejecuta en un proceso aparte)
+    
+    Returns:
+        Tupla (tile_id, datos, logs); tile_id y datos son None si no se pudo
+        organizar el producto. logs es una lista de (nivel, mensaje).
+    """
+    logs = []
+    def log(level, msg):
+        logs.append((level, msg))
+    
+    band_re = _band_pattern(target_bands)
+    log(logging.INFO, f"Extrayendo bandas de: {zip_file}")
+    
+    # Crear directorio de extracción con nombre más corto para evitar problemas de ruta larga
+    zip_path = Path(zip_file)
+    # Usar solo el tile ID y fecha para el directorio
+    safe_name = zip_path.stem
+    tile_id, date_part = CopernicusDownloader._parse_product_name(safe_name)
+    
+    # Crear nombre corto para el directorio
+    if tile_id and date_part:
+        short_name = f"{tile_id}_{date_part}"
+    else:
+        short_name = safe_name[:50]  # Truncar si es muy largo
+    
+    extract_dir = Path(download_dir_str) / short_name
+    
+    # Limpiar directorio si existe
+    if extract_dir.exists():
+        try:
+            shutil.rmtree(extract_dir)
+        except OSError as e:
+            log(logging.WARNING, f"No se pudo limpiar directorio existente: {e}")
+    
+    extract_dir.mkdir(exist_ok=True)
+    
+    try:
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref, open(zip_file, 'rb') as raw_zip:
+            band_files = {}
+            extracted_files = []
+            jp2_files = []
+            
+            # Una sola pasada por el directorio central del ZIP; cada banda se copia
+            # directamente a extract_dir sin recrear la ruta larga del .SAFE
+            for info in zip_ref.infolist():
+                if not info.filename.endswith('.jp2'):
+                    continue
+                jp2_files.append(info.filename)
+                match = band_re.search(info.filename)
+                if not match:
+                    continue
+                band = match.group(1)
+                out_path = extract_dir / Path(info.filename).name
+                try:
+                    _copy_zip_member(zip_ref, raw_zip, info, out_path)
+                except Exception as extract_error:
+                    log(logging.ERROR, f"  ✗ Error extrayendo {info.filename}: {extract_error}")
+                    continue
+                band_files[band] = str(out_path.resolve())
+                extracted_files.append(str(out_path))
+            
+            log(logging.INFO, f"  Archivos de bandas objetivo extraídos: {len(band_files)}/{len(target_bands)}")
+            
+            # Si se encontraron bandas, organizar por tile
+            if band_files:
+                product_name = safe_name
+                
+                if tile_id:
+                    log(logging.INFO, f"  ✓ Procesado tile {tile_id} con {len(band_files)} bandas: {list(band_files.keys())}")
+                    return tile_id, {
+                        'date': CopernicusDownloader._parse_date(date_part),
+                        'bands': band_files,
+                        'product_name': product_name,
+                        'extract_dir': str(extract_dir),
+                        'extracted_files': extracted_files
+                    }, logs
+                log(logging.WARNING, f"  ✗ No se pudo extraer tile ID de: {product_name}")
+            else:
+                log(logging.WARNING, f"  ✗ No se encontraron bandas objetivo en: {zip_path.name}")
+                
+                # Debug: mostrar archivos JP2 disponibles
+                log(logging.INFO, f"  Archivos JP2 disponibles en ZIP: {len(jp2_files)}")
+                
+                # Mostrar algunos ejemplos
+                for jp2_file in jp2_files[:5]:
+                    log(logging.INFO, f"    {Path(jp2_file).name}")
+                
+                if len(jp2_files) > 5:
+                    log(logging.INFO, f"    ... y {len(jp2_files) - 5} archivos más")
+    
+    except zipfile.BadZipFile:
+        log(logging.ERROR, f"Archivo ZIP corrupto: {zip_file}")
+    except PermissionError as e:
+        log(logging.ERROR, f"Error de permisos extrayendo {zip_file}: {e}")
+    except Exception as e:
+        log(logging.ERROR, f"Error general extrayendo {zip_file}: {e}")
+        log(logging.ERROR, f"Tipo de error: {type(e).__name__}")
+        
+        # Información adicional para debugging
+        if "path too long" in str(e).lower() or len(str(extract_dir)) > 200:
+            log(logging.ERROR, "Problema con rutas largas detectado.")
+            log(logging.ERROR, f"Longitud de ruta base: {len(str(extract_dir))} caracteres")
+            log(logging.ERROR, "Soluciones:")
+            log(logging.ERROR, "1. Mover los archivos a C:\\temp o similar")
+            log(logging.ERROR, "2. Usar un directorio de descarga más corto")
+    
+    return None, None, logs
+
+class AsyncCopernicusDownloader(CopernicusDownloader):
+    """
+    Variante asíncrona de CopernicusDownloader basada en aiohttp
+    
+    Las búsquedas y descargas de un período se multiplexan en un solo bucle de
+    eventos; la extracción de los ZIP sigue ejecutándose fuera del bucle.
+    Las descargas siguen las mismas reglas que download_product (omisión por
+    tamaño, partes con Range, archivo .part, progreso) y download_for_period
+    conserva la interfaz síncrona, así que puede sustituir a la clase base.
+    """
+    def _client_session(self):
+        """Crear la sesión aiohttp compartida por las peticiones de un período"""
+        import aiohttp
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=16, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        )
+    
+    def _auth_headers(self):
+        with self._token_lock:
+            return {"Authorization": f"Bearer {self.access_token}"}
+    
+    async def get_access_token_async(self, session):
+        """Obtener token de acceso de Copernicus Data Space"""
+        import aiohttp
+        data = {
+            "grant_type": "password",
+            "username": self.username,
+            "password": self.password,
+            "client_id": "cdse-public"
+        }
+        try:
+            async with session.post(self.auth_url, data=data) as response:
+                response.raise_for_status()
+                self._store_token(await response.json())
+            return True
+        except aiohttp.ClientError as e:
+            raise Exception(f"Error de autenticación: {str(e)}")
+    
+    def _async_token_lock(self):
+        """Bloqueo de renovación del token para el bucle de eventos en curso"""
+        # asyncio.Lock pertenece a un bucle y download_for_period crea uno por período
+        loop = asyncio.get_running_loop()
+        if getattr(self, '_async_lock_loop', None) is not loop:
+            self._async_lock_loop = loop
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
+    
+    async def renovar_token_si_necesario_async(self, session):
+        """Obtener un token nuevo solo si no hay uno o está por caducar"""
+        # Comprobación y renovación bajo el mismo bloqueo: con asyncio.gather solo
+        # la primera corrutina pide el token y el resto espera y lo reutiliza
+        async with self._async_token_lock():
+            if not self.access_token:
+                await self.get_access_token_async(session)
+            elif time.monotonic() >= self.token_expiry:
+                self.logger.info("Token expirado. Renovando...")
+                await self.get_access_token_async(session)
+    
+    async def _get_with_token_retry_async(self, session, url, headers=None):
+        """GET que renueva el token y reintenta una vez si el servidor responde 401"""
+        token = self.access_token
+        response = await session.get(url, headers={**self._auth_headers(), **(headers or {})})
+        if response.status == 401:
+            response.release()
+            async with self._async_token_lock():
+                # Otra corrutina puede haber sustituido ya el token rechazado
+                if self.access_token == token:
+                    self.logger.info("Token rechazado por el servidor. Renovando...")
+                    await self.get_access_token_async(session)
+            response = await session.get(url, headers={**self._auth_headers(), **(headers or {})})
+        return response
+    
+    async def search_sentinel2_products_async(self, session, start_date, end_date, aoi=None, max_cloud_cover=20, max_results=50):
+        """Buscar productos Sentinel-2 usando la nueva API"""
+        import aiohttp
+        if aoi is None:
+            aoi = self.tlaxcala_bounds
+        
+        cache_path = self._search_cache_path(start_date, end_date, aoi.bounds, max_cloud_cover, max_results)
+        cached = self._load_search_cache(cache_path)
+        if cached is not None:
+            return cached
+        
+        await self.renovar_token_si_necesario_async(session)
+        params = self._build_search_params(start_date, end_date, aoi.bounds, max_cloud_cover, max_results)
+        
+        try:
+            async with session.get(self.catalog_url, params=params, headers=self._auth_headers()) as response:
+                response.raise_for_status()
+                products_data = await response.json()
+            products_list = [self._parse_product(product) for product in products_data.get("value", [])]
+            return self._finish_search(products_list, cache_path)
+        except aiohttp.ClientError as e:
+            raise Exception(f"Error al buscar productos: {str(e)}")
+    
+    async def download_product_async(self, session, product_id, product_title):
+        """Descargar un producto específico con renovación de token si es necesario"""
+        import aiohttp
+        import aiofiles
+        
+        await self.renovar_token_si_necesario_async(session)
+        
+        download_endpoint = f"{self.download_url}({product_id})/$value"
+        filepath, part_path = self._download_paths(product_title)
+        
+        # Consultar tamaño remoto y soporte de rangos antes de descargar
+        remote_size = -1
+        accepts_ranges = False
+        try:
+            async with session.head(download_endpoint, headers=self._auth_headers(), allow_redirects=True) as head:
+                head.raise_for_status()
+                remote_size = int(head.headers.get('Content-Length', -1))
+                accepts_ranges = head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        except (aiohttp.ClientError, ValueError) as e:
+            self.logger.warning(f"No se pudo consultar el tamaño de {filepath.name}: {e}")
+        
+        if self._is_complete(filepath, remote_size):
+            return str(filepath)
+        
+        self.logger.info(f"Descargando: {product_title}")
+        
+        try:
+            if accepts_ranges and remote_size >= self.MIN_RANGED_SIZE:
+                await self._download_in_parts_async(session, download_endpoint, part_path, remote_size)
+            else:
+                async with await self._get_with_token_retry_async(session, download_endpoint) as response:
+                    response.raise_for_status()
+                    total_size = int(response.headers.get('Content-Length', 0))
+                    
+                    with open(part_path, 'wb') as f:
+                        if total_size > 0:
+                            self._preallocate(f, total_size)
+                    progress = ProgressWriter(None, total_size, self.logger)
+                    async with aiofiles.open(part_path, 'r+b') as f:
+                        async for chunk in response.content.iter_chunked(1 << 20):
+                            await f.write(chunk)
+                            progress.update(len(chunk))
+                        # Descartar espacio reservado sobrante si se recibieron menos bytes
+                        await f.truncate(progress.written)
+            
+            # Solo una descarga completa recibe el nombre final
+            os.replace(part_path, filepath)
+            self.logger.info(f"Descarga completada: {filepath}")
+            return str(filepath)
+        
+        except Exception as e:
+            self.logger.error(f"Error descargando {product_title}: {e}")
+            if part_path.exists():
+                part_path.unlink()  # Eliminar archivo incompleto
+            raise
+    
+    async def _download_in_parts_async(self, session, url, part_path, total_size):
+        """Descargar un archivo en varias partes concurrentes usando peticiones Range"""
+        import aiofiles
+        
+        # Reservar el tamaño final para que cada parte escriba en su desplazamiento
+        with open(part_path, 'wb') as f:
+            self._preallocate(f, total_size)
+        
+        ranges = self._part_ranges(total_size)
+        
+        async def fetch(offset, length):
+            headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+            async with await self._get_with_token_retry_async(session, url, headers) as response:
+                response.raise_for_status()
+                if response.status != 206:
+                    raise Exception(f"El servidor ignoró la petición de rango (HTTP {response.status})")
+                # Cada parte usa su propio descriptor y escribe solo en su región
+                async with aiofiles.open(part_path, 'r+b') as f:
+                    await f.seek(offset)
+                    async for chunk in response.content.iter_chunked(1 << 20):
+                        await f.write(chunk)
+        
+        tasks = [asyncio.ensure_future(fetch(offset, length)) for offset, length in ranges]
+        try:
+            for i, part in enumerate(asyncio.as_completed(tasks), 1):
+                await part
+                self.logger.info(f"Progreso: {i}/{len(ranges)} partes de {part_path.name}")
+        except BaseException:
+            # Si una parte falla, detener las demás antes de borrar el archivo .part
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    
+    async def download_for_period_async(self, start_date, end_date, shapefile_path=None, max_cloud_cover=20, max_products=5):
+        """Descargar imágenes para un período específico"""
+        try:
+            async with self._client_session() as session:
+                await self.renovar_token_si_necesario_async(session)
+                
+                aoi = None
+                if shapefile_path:
+                    aoi = self.create_aoi_from_shapefile(shapefile_path)
+                
+                products = await self.search_sentinel2_products_async(
+                    session, start_date, end_date, aoi, max_cloud_cover, max_products
+                )
+                
+                if not products:
+                    self.logger.warning(f"No se encontraron productos para el período seleccionado")
+                    return {}
+                
+                # Descargar todos los productos concurrentemente
+                results = await asyncio.gather(
+                    *(self.download_product_async(session, p.id, p.title) for p in products[:max_products]),
+                    return_exceptions=True
+                )
+            
+            downloaded_files = []
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    self.logger.error(f"Error descargando producto {i+1}: {result}")
+                else:
+                    downloaded_files.append(result)
+            
+            if not downloaded_files:
+                self.logger.warning("No se pudieron descargar productos")
+                return {}
+            
+            # La extracción es E/S local bloqueante: ejecutarla fuera del bucle de eventos
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.extract_and_organize_bands, downloaded_files)
+        
+        except Exception as e:
+            self.logger.error(f"Error en download_for_period: {e}")
+            raise
+    
+    def download_for_period(self, start_date, end_date, shapefile_path=None, max_cloud_cover=20, max_products=5):
+        """Versión síncrona de download_for_period_async (p. ej. desde el hilo de la GUI)"""
+        return asyncio.run(self.download_for_period_async(
+            start_date, end_date, shapefile_path, max_cloud_cover, max_products
+        ))
+
 class SentinelDownloaderGUI:
     def __init__(self, root):
         self.root = root
@@ -489,6 +1063,7 @@ class SentinelDownloaderGUI:
         self.root.geometry("800x700")
         
         self.downloader = None
+        self.downloader_key = None
         self.shapefile_path = None
         
         self.setup_ui()
@@ -519,11 +1094,13 @@ class SentinelDownloaderGUI:
         cred_frame.pack(fill=tk.X, padx=10, pady=5)
         
         ttk.Label(cred_frame, text="Usuario:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
-        self.username_entry = ttk.Entry(cred_frame, width=30)
+        self.username_var = tk.StringVar()
+        self.username_entry = ttk.Entry(cred_frame, textvariable=self.username_var, width=30)
         self.username_entry.grid(row=0, column=1, padx=5, pady=5)
         
         ttk.Label(cred_frame, text="Contraseña:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
-        self.password_entry = ttk.Entry(cred_frame, width=30, show="*")
+        self.password_var = tk.StringVar()
+        self.password_entry = ttk.Entry(cred_frame, textvariable=self.password_var, width=30, show="*")
         self.password_entry.grid(row=1, column=1, padx=5, pady=5)
         
         # Configuración de conexión
@@ -603,6 +1180,10 @@ class SentinelDownloaderGUI:
         
         self.log_text = scrolledtext.ScrolledText(log_frame, height=15)
         self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        # Descartar el descargador compartido si cambian credenciales o conexión
+        for var in (self.username_var, self.password_var, self.timeout_var, self.download_dir_var):
+            var.trace_add('write', self._invalidate_downloader)
     
     def setup_logging(self):
         """Configurar el sistema de logging"""
@@ -615,6 +1196,19 @@ class SentinelDownloaderGUI:
         logger = logging.getLogger()
         logger.addHandler(text_handler)
     
+    def _invalidate_downloader(self, *args):
+        """Olvidar el descargador actual (cambiaron credenciales o configuración)"""
+        self.downloader = None
+        self.downloader_key = None
+    
+    def _get_downloader(self, username, password, timeout):
+        """Reutilizar el descargador (y su token y conexiones) entre acciones del usuario"""
+        key = (username, password, timeout, self.download_dir_var.get())
+        if self.downloader is None or self.downloader_key != key:
+            self.downloader = CopernicusDownloader(username, password, key[3], timeout)
+            self.downloader_key = key
+        return self.downloader
+    
     def select_download_dir(self):
         """Seleccionar directorio de descarga"""
         directory = filedialog.askdirectory()
@@ -645,8 +1239,8 @@ class SentinelDownloaderGUI:
                 
                 timeout = int(self.timeout_var.get())
                 
-                # Crear instancia del descargador con las nuevas credenciales
-                downloader = CopernicusDownloader(username, password, timeout=timeout)
+                # Descargador compartido con "Iniciar Descarga"
+                downloader = self._get_downloader(username, password, timeout)
                 
                 success, message = downloader.test_connection()
                 
@@ -700,65 +1294,122 @@ class SentinelDownloaderGUI:
                 self.progress.start()
                 self.download_btn.config(state='disabled')
 
-                self.downloader = CopernicusDownloader(
-                    username, password, self.download_dir_var.get(), timeout
-                )
+                # Importaciones pesadas (numba, rasterio, matplotlib, docx) solo al procesar
+                # y fuera del hilo de Tk, para que la ventana no se congele al cargarlas. Los
+                # núcleos Numba paralelos se compilan al primer uso, en los procesos del pool.
+                # Dentro del try: si fallan se muestra el error en lugar de morir el hilo.
+                import rasterio
+                from ndvi_processor import GDAL_OPCIONES, procesar_ndvi_por_tiles
+                from recortar_por_estado import recortar_ndvi_con_tlaxcala
+                from see_ndvi import visualizar_ndvi
 
-                shapefile_path = self.shapefile_var.get() if self.shapefile_var.get() else None
+                # Canalización en tres etapas: mientras se descarga el mes N+1 se calcula el
+                # NDVI del mes N y se guarda la figura del mes N-1. None marca el final.
+                q_ndvi = queue.Queue(maxsize=2)
+                q_viz = queue.Queue(maxsize=2)
+                # La geometría de Tlaxcala se lee una vez y queda en caché (ver recortar_por_estado)
+                zip_path = "Estados_Mexico.zip"
 
-                current_start = start_date
+                def procesar_worker():
+                    try:
+                        # Ajustes de GDAL (caché, lecturas remotas, hilos) para todo el procesamiento
+                        with rasterio.Env(**GDAL_OPCIONES):
+                            while True:
+                                item = q_ndvi.get()
+                                if item is None:
+                                    return
+                                periodo_tag, organized_bands, inicio, fin = item
+                                try:
+                                    procesar_ndvi_por_tiles(
+                                        organized_bands,
+                                        output_folder=f"NDVI_output_{periodo_tag}"
+                                    )
+                                except Exception as e:
+                                    logging.error(f"Error al calcular NDVI de {periodo_tag}: {e}")
+                                    continue
 
-                while current_start < end_date:
-                    # Calcular fin de mes
-                    last_day = calendar.monthrange(current_start.year, current_start.month)[1]
-                    current_end = datetime(
-                        current_start.year, current_start.month, last_day
-                    )
+                                # Recorte
+                                try:
+                                    ndvi_mosaico = f"NDVI_output_{periodo_tag}/NDVI_MOSAICO.vrt"
+                                    salida_recorte = f"NDVI_output_{periodo_tag}/NDVI_TLAXCALA.tif"
+                                    recortar_ndvi_con_tlaxcala(zip_path, ndvi_mosaico, salida_recorte)
+                                    logging.info(f"✓ Recorte para Tlaxcala: {salida_recorte}")
+                                except Exception as e:
+                                    logging.warning(f"No se pudo recortar Tlaxcala: {e}")
+                                    continue
+                                q_viz.put((periodo_tag, salida_recorte, inicio, fin))
+                    except Exception as e:
+                        logging.error(f"La etapa de NDVI se detuvo: {e}")
+                        # Seguir vaciando q_ndvi hasta el None: si no, el productor se bloquea
+                        while q_ndvi.get() is not None:
+                            pass
+                    finally:
+                        q_viz.put(None)
+
+                def visualizar_worker():
+                    while True:
+                        item = q_viz.get()
+                        if item is None:
+                            return
+                        periodo_tag, salida_recorte, inicio, fin = item
+                        # Visualizar (se guarda como PNG: plt.show bloquearía la canalización)
+                        try:
+                            imagen = visualizar_ndvi(
+                                ndvi_path=salida_recorte,
+                                fecha_inicio=inicio.date(),
+                                fecha_fin=fin.date(),
+                                salida_png=f"NDVI_output_{periodo_tag}/NDVI_TLAXCALA.png"
+                            )
+                            logging.info(f"✓ Figura NDVI guardada: {imagen}")
+                        except Exception as e:
+                            logging.warning(f"No se pudo visualizar NDVI: {e}")
 
-                    # Limitar al rango real
-                    if current_end > end_date:
-                        current_end = end_date
+                etapas = [
+                    threading.Thread(target=procesar_worker, daemon=True),
+                    threading.Thread(target=visualizar_worker, daemon=True),
+                ]
+                for etapa in etapas:
+                    etapa.start()
 
-                    periodo_tag = current_start.strftime("%Y%m")  # ej. 202405
+                try:
+                    downloader = self._get_downloader(username, password, timeout)
 
-                    logging.info(f"Procesando periodo: {current_start.date()} - {current_end.date()}")
+                    shapefile_path = self.shapefile_var.get() if self.shapefile_var.get() else None
 
-                    organized_bands = self.downloader.download_for_period(
-                        current_start, current_end, shapefile_path, max_cloud_cover, max_products
-                    )
+                    current_start = start_date
 
-                    if organized_bands:
-                        logging.info("✓ Descarga completada exitosamente")
-                        procesar_ndvi_por_tiles(
-                            organized_bands,
-                            output_folder=f"NDVI_output_{periodo_tag}"
+                    while current_start < end_date:
+                        # Calcular fin de mes
+                        last_day = calendar.monthrange(current_start.year, current_start.month)[1]
+                        current_end = datetime(
+                            current_start.year, current_start.month, last_day
                         )
 
-                        # Recorte
-                        try:
-                            zip_path = "Estados_Mexico.zip"
-                            ndvi_mosaico = f"NDVI_output_{periodo_tag}/NDVI_MOSAICO.tif"
-                            salida_recorte = f"NDVI_output_{periodo_tag}/NDVI_TLAXCALA.tif"
-                            recortar_ndvi_con_tlaxcala(zip_path, ndvi_mosaico, salida_recorte)
-                            logging.info(f"✓ Recorte para Tlaxcala: {salida_recorte}")
-                        except Exception as e:
-                            logging.warning(f"No se pudo recortar Tlaxcala: {e}")
+                        # Limitar al rango real
+                        if current_end > end_date:
+                            current_end = end_date
 
-                        # Visualizar
-                        try:
-                            visualizar_ndvi(
-                                ndvi_path=salida_recorte,
-                                fecha_inicio=current_start.date(),
-                                fecha_fin=current_end.date()
-                            )
-                        except Exception as e:
-                            logging.warning(f"No se pudo visualizar NDVI: {e}")
+                        periodo_tag = current_start.strftime("%Y%m")  # ej. 202405
 
-                    else:
-                        logging.warning(f"No se descargaron productos en {current_start.date()} - {current_end.date()}")
+                        logging.info(f"Procesando periodo: {current_start.date()} - {current_end.date()}")
+
+                        organized_bands = downloader.download_for_period(
+                            current_start, current_end, shapefile_path, max_cloud_cover, max_products
+                        )
+
+                        if organized_bands:
+                            logging.info("✓ Descarga completada exitosamente")
+                            q_ndvi.put((periodo_tag, organized_bands, current_start, current_end))
+                        else:
+                            logging.warning(f"No se descargaron productos en {current_start.date()} - {current_end.date()}")
 
-                    # Avanzar al siguiente mes
-                    current_start = current_end + relativedelta(days=1)
+                        # Avanzar al siguiente mes
+                        current_start = current_end + relativedelta(days=1)
+                finally:
+                    # Cerrar la canalización y esperar a que terminen las etapas pendientes
+                    q_ndvi.put(None)
+                    for etapa in etapas:
+                        etapa.join()
 
                 messagebox.showinfo("Éxito", f"NDVI procesado y recortado para múltiples periodos.")
 
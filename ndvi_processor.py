@@ -1,12 +1,265 @@
+import multiprocessing
 import os
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import rasterio
 import numpy as np
-from rasterio.merge import merge
 from rasterio.enums import Resampling
 from rasterio.warp import reproject
-from scipy.ndimage import gaussian_filter
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
+from rasterio.transform import from_origin
+from rasterio.errors import WindowError
+from numba import guvectorize, njit, prange
 
-def calcular_ndvi(band_nir_path, band_red_path):
+# El NDVI se guarda como int16 = NDVI * NDVI_ESCALA (convención MODIS/Sentinel)
+NDVI_ESCALA = 10000
+NDVI_NODATA = -32768
+
+# Configuración de GDAL para el procesamiento: caché de bloques de 1 GB, lecturas
+# remotas en trozos de 2 MB con caché VSI de 256 MB y decodificación JP2 multihilo
+GDAL_OPCIONES = {
+    'GDAL_CACHEMAX': 1024,
+    'CPL_VSIL_CURL_CHUNK_SIZE': 2097152,
+    'VSI_CACHE': True,
+    'VSI_CACHE_SIZE': 268435456,
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'GDAL_NUM_THREADS': 'ALL_CPUS'
+}
+
+# Niveles de overviews internos de los GeoTIFF NDVI (lecturas rápidas de vista previa)
+NDVI_OVERVIEWS = [2, 4, 8, 16]
+
+# Núcleo Gaussiano 1-D (sigma=1, truncado a 3 sigma: 7 coeficientes), calculado una vez
+_GAUSS_SIGMA1 = np.exp(-0.5 * np.arange(-3, 4) ** 2)
+_GAUSS_SIGMA1 /= _GAUSS_SIGMA1.sum()
+
+# Tamaño de bloque del cálculo fusionado NDVI + suavizado
+_TILE = 512
+
+# Filas de bloques de salida (256 px) que calcular_ndvi_por_bloques procesa juntas:
+# franjas de ancho completo con muchos bloques _TILE para repartir entre hilos
+_FRANJA_BLOQUES = 4
+
+# Pesos Catmull-Rom para el remuestreo x2: los centros de píxel de la rejilla
+# fina caen siempre a 1/4 o 3/4 de los de la rejilla gruesa
+_CR_025 = np.array([-0.0703125, 0.8671875, 0.2265625, -0.0234375], dtype=np.float32)
+_CR_075 = np.array([-0.0234375, 0.2265625, 0.8671875, -0.0703125], dtype=np.float32)
+
+def _ndvi_fila(nir, red, out):
+    """NDVI de una fila: suma, diferencia y división protegida por píxel"""
+    for j in range(nir.shape[0]):
+        s = nir[j] + red[j]
+        out[j] = 0.0 if s == 0.0 else (nir[j] - red[j]) / s
+
+@lru_cache(maxsize=None)
+def _ndvi_gu():
+    """
+    Ufunc NDVI compilada una vez y guardada en disco (cache=True): los procesos del
+    pool la cargan sin recompilar. El núcleo es una fila; las filas se reparten entre hilos.
+
+    Se construye al primer uso y no al importar (ver _njit_perezoso).
+    """
+    return guvectorize(['void(float32[:], float32[:], float32[:])'], '(n),(n)->(n)',
+                       target='parallel', fastmath=True, cache=True)(_ndvi_fila)
+
+def _njit_perezoso(firmas, **opciones):
+    """
+    Como njit(firmas, **opciones), pero compila (o carga de la caché) en la primera
+    llamada y no al importar. Compilar un núcleo parallel=True arranca la capa de
+    hilos de Numba: al importar, eso congelaría la GUI (que importa este módulo desde
+    su hilo de descarga) y arrancaría TBB en un hilo secundario, lo que bloquea la
+    salida del intérprete. Los núcleos solo se llaman en los procesos del pool.
+    """
+    def decorador(fn):
+        compilar = lru_cache(maxsize=None)(lambda: njit(firmas, **opciones)(fn))
+
+        def nucleo(*args):
+            return compilar()(*args)
+        nucleo.__doc__ = fn.__doc__
+        return nucleo
+    return decorador
+
+# Firmas explícitas: una sola especialización, sin inferencia de tipos en la primera
+# llamada. '::1' = C-contiguo. _reflect (sin hilos) se compila al importar.
+@njit('int64(int64, int64)', cache=True)
+def _reflect(i, n):
+    """Índice reflejado en el borde (equivale a mode='reflect' de scipy.ndimage)"""
+    # Se refleja hasta caer dentro: con lados menores que el radio del núcleo
+    # un solo reflejo todavía queda fuera del array
+    while i < 0 or i >= n:
+        if i < 0:
+            i = -i - 1
+        else:
+            i = 2 * n - i - 1
+    return i
+
+@_njit_perezoso('void(float32[:, ::1], float32[:, ::1], float64[::1], float32[:, ::1], int64)',
+                parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _ndvi_tile_kernel(nir, red, kernel, out, tile):
+    """
+    NDVI + suavizado separable por bloques de tile x tile píxeles
+
+    Cada bloque calcula el NDVI de su región ampliada con un halo del radio del
+    núcleo y aplica la pasada horizontal y la vertical en memoria local, de modo
+    que el NDVI sin suavizar nunca se escribe completo.
+    """
+    h, w = nir.shape
+    r = kernel.shape[0] // 2
+    n_ty = (h + tile - 1) // tile
+    n_tx = (w + tile - 1) // tile
+    for t in prange(n_ty * n_tx):
+        y0 = (t // n_tx) * tile
+        x0 = (t % n_tx) * tile
+        y1 = min(y0 + tile, h)
+        x1 = min(x0 + tile, w)
+        bh = y1 - y0 + 2 * r
+        bw = x1 - x0 + 2 * r
+
+        # NDVI del bloque con halo
+        block = np.empty((bh, bw), dtype=np.float32)
+        for i in range(bh):
+            yi = _reflect(y0 - r + i, h)
+            for j in range(bw):
+                xj = _reflect(x0 - r + j, w)
+                s = nir[yi, xj] + red[yi, xj]
+                block[i, j] = 0.0 if s == 0.0 else (nir[yi, xj] - red[yi, xj]) / s
+
+        # Pasada horizontal (solo columnas interiores)
+        rows = np.empty((bh, x1 - x0), dtype=np.float32)
+        for i in range(bh):
+            for j in range(x1 - x0):
+                acc = 0.0
+                for k in range(2 * r + 1):
+                    acc += kernel[k] * block[i, j + k]
+                rows[i, j] = acc
+
+        # Pasada vertical, directamente al resultado
+        for i in range(y1 - y0):
+            for j in range(x1 - x0):
+                acc = 0.0
+                for k in range(2 * r + 1):
+                    acc += kernel[k] * rows[i + k, j]
+                out[y0 + i, x0 + j] = acc
+
+@_njit_perezoso('void(float32[:, ::1], float32[:, ::1])', parallel=True, boundscheck=False, cache=True)
+def _box3_sep(img, out):
+    """
+    Filtro de caja 3x3 separable con sumas acumuladas (aprox. Gaussiana de sigma≈0.8):
+    una suma y una resta por píxel y pasada, bordes reflejados como en _reflect.
+    """
+    h, w = img.shape
+    tmp = np.empty((h, w), dtype=np.float32)
+    tercio = 1.0 / 3.0
+
+    # Pasada horizontal, una fila por iteración
+    for i in prange(h):
+        s = 2.0 * img[i, 0] + img[i, _reflect(1, w)]
+        tmp[i, 0] = s * tercio
+        for j in range(1, w):
+            s += img[i, _reflect(j + 1, w)] - img[i, _reflect(j - 2, w)]
+            tmp[i, j] = s * tercio
+
+    # Pasada vertical por franjas de columnas, recorriendo filas contiguas en memoria
+    franja = 256
+    for c in prange((w + franja - 1) // franja):
+        c0 = c * franja
+        c1 = min(c0 + franja, w)
+        acc = np.empty(c1 - c0, dtype=np.float64)
+        for j in range(c0, c1):
+            acc[j - c0] = 2.0 * tmp[0, j] + tmp[_reflect(1, h), j]
+            out[0, j] = acc[j - c0] * tercio
+        for i in range(1, h):
+            sig = _reflect(i + 1, h)
+            ant = _reflect(i - 2, h)
+            for j in range(c0, c1):
+                acc[j - c0] += tmp[sig, j] - tmp[ant, j]
+                out[i, j] = acc[j - c0] * tercio
+
+@_njit_perezoso(['void(uint16[:, ::1], float32[:, ::1], int64, int64)',
+                 'void(float32[:, ::1], float32[:, ::1], int64, int64)'],
+                parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _upsample2x_cubic(src, out, y0, x0):
+    """
+    Remuestreo x2 con interpolación cúbica (Catmull-Rom) de src sobre out.
+    (y0, x0) es la posición de out[0, 0] en la rejilla x2 relativa a src[0, 0].
+    En los bordes se sigue al warper de GDAL (reproject con Resampling.cubic):
+    donde los 4x4 píxeles del núcleo no caben en src se usa interpolación
+    bilineal con los píxeles existentes y pesos renormalizados. src puede ser
+    uint16 (bandas Sentinel sin convertir) o float32.
+    """
+    h, w = src.shape
+    for i in prange(out.shape[0]):
+        yy = y0 + i
+        by = (yy - 1) // 2
+        wy = _CR_075 if yy % 2 == 0 else _CR_025
+        fy = 0.25 if yy % 2 == 0 else 0.75
+        for j in range(out.shape[1]):
+            xx = x0 + j
+            bx = (xx - 1) // 2
+            acc = 0.0
+            if by < 1 or by + 2 >= h or bx < 1 or bx + 2 >= w:
+                # Borde: bilineal sobre (by, bx) y (by+1, bx+1), omitiendo lo que cae fuera
+                fx = 0.25 if xx % 2 == 0 else 0.75
+                peso = 0.0
+                for m in range(2):
+                    sy = by + m
+                    if sy < 0 or sy >= h:
+                        continue
+                    py = fy if m == 0 else 1.0 - fy
+                    for n in range(2):
+                        sx = bx + n
+                        if sx < 0 or sx >= w:
+                            continue
+                        p = py * (fx if n == 0 else 1.0 - fx)
+                        acc += p * src[sy, sx]
+                        peso += p
+                out[i, j] = acc / peso
+            else:
+                wx = _CR_075 if xx % 2 == 0 else _CR_025
+                for m in range(4):
+                    row = 0.0
+                    for n in range(4):
+                        row += wx[n] * src[by - 1 + m, bx - 1 + n]
+                    acc += wy[m] * row
+                out[i, j] = acc
+
+def _banda_kernel(data):
+    """Banda en un tipo aceptado por _upsample2x_cubic: uint16 tal cual, el resto a float32"""
+    if data.dtype == np.uint16:
+        return np.ascontiguousarray(data)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+def _es_rejilla_doble(nir_src, red_src):
+    """True si RED es exactamente la rejilla NIR con píxeles del doble de tamaño"""
+    nt, rt = nir_src.transform, red_src.transform
+    return (nir_src.crs == red_src.crs
+            and nt.b == 0 and nt.d == 0 and rt.b == 0 and rt.d == 0
+            and abs(rt.a - 2 * nt.a) < 1e-6 and abs(rt.e - 2 * nt.e) < 1e-6
+            and abs(rt.c - nt.c) < 1e-6 and abs(rt.f - nt.f) < 1e-6)
+
+def _radio_suavizado(smooth):
+    """Halo (px) que necesita cada modo de suavizado"""
+    return {'gauss': len(_GAUSS_SIGMA1) // 2, 'box': 1, None: 0}[smooth]
+
+def _ndvi_suavizado(nir, red, smooth):
+    """NDVI con el suavizado elegido: 'gauss' (sigma=1), 'box' (caja 3x3) o None"""
+    ndvi = np.empty(nir.shape, dtype=np.float32)
+    if smooth == 'gauss':
+        _ndvi_tile_kernel(nir, red, _GAUSS_SIGMA1, ndvi, _TILE)
+    elif smooth == 'box':
+        crudo = np.empty(nir.shape, dtype=np.float32)
+        _ndvi_gu()(nir, red, crudo)
+        _box3_sep(crudo, ndvi)
+    elif smooth is None:
+        _ndvi_gu()(nir, red, ndvi)
+    else:
+        raise ValueError(f"Suavizado no reconocido: {smooth!r}")
+    return ndvi
+
+def calcular_ndvi(band_nir_path, band_red_path, smooth='gauss'):
     with rasterio.open(band_nir_path) as nir_src, rasterio.open(band_red_path) as red_src:
         nir_data = nir_src.read(1).astype('float32')
         nir_transform = nir_src.transform
@@ -15,82 +268,276 @@ def calcular_ndvi(band_nir_path, band_red_path):
         red_data_resampled = np.empty(nir_shape, dtype='float32')
 
         # Reescalado de la banda RED con interpolación cúbica (mayor calidad)
-        reproject(
-            source=red_src.read(1),
-            destination=red_data_resampled,
-            src_transform=red_src.transform,
-            src_crs=red_src.crs,
-            dst_transform=nir_transform,
-            dst_crs=nir_src.crs,
-            resampling=Resampling.cubic
-        )
-
-        # Cálculo del NDVI
-        ndvi = np.where(
-            (nir_data + red_data_resampled) == 0,
-            0,
-            (nir_data - red_data_resampled) / (nir_data + red_data_resampled)
-        )
-
-        # Suavizado opcional con filtro Gaussiano
-        ndvi = gaussian_filter(ndvi, sigma=1)
-
-        # Perfil del raster
-        profile = nir_src.profile.copy()
+        if _es_rejilla_doble(nir_src, red_src):
+            _upsample2x_cubic(_banda_kernel(red_src.read(1)), red_data_resampled, 0, 0)
+        else:
+            reproject(
+                source=red_src.read(1),
+                destination=red_data_resampled,
+                src_transform=red_src.transform,
+                src_crs=red_src.crs,
+                dst_transform=nir_transform,
+                dst_crs=nir_src.crs,
+                resampling=Resampling.cubic
+            )
+
+        # Cálculo del NDVI y suavizado (Gaussiano fusionado por bloques por defecto)
+        ndvi = _ndvi_suavizado(nir_data, red_data_resampled, smooth)
+
+        return ndvi, _perfil_ndvi(nir_src)
+
+def _perfil_ndvi(nir_src):
+    """Perfil del raster NDVI de salida (int16 escalado, ver NDVI_ESCALA)"""
+    profile = nir_src.profile.copy()
+    profile.update({
+        'driver': 'GTiff',
+        'dtype': 'int16',
+        'nodata': NDVI_NODATA,
+        'count': 1,
+        'compress': 'deflate',
+        'predictor': 2,
+        'zlevel': 1,
+        'tiled': True,
+        'blockxsize': 256,
+        'blockysize': 256
+    })
+    return profile
+
+def _agregar_overviews(dst):
+    """Construye overviews internos promediados (respetan el nodata) al final de la escritura"""
+    dst.build_overviews(NDVI_OVERVIEWS, Resampling.average)
+    dst.update_tags(ns='rio_overview', resampling='average')
+
+def _escalar_ndvi(ndvi):
+    """NDVI float en [-1, 1] a int16 escalado por NDVI_ESCALA"""
+    return np.rint(np.clip(ndvi * NDVI_ESCALA, -NDVI_ESCALA, NDVI_ESCALA)).astype(np.int16)
+
+def calcular_ndvi_por_bloques(band_nir_path, band_red_path, output_path, smooth='gauss'):
+    """
+    Calcula y guarda el NDVI por franjas, sin cargar las bandas completas.
+    Cada franja (_FRANJA_BLOQUES filas de bloques, ancho completo) se lee con un
+    halo para el suavizado; la banda RED se remuestrea al vuelo sobre la misma
+    ventana de la banda NIR. Las franjas caen en límites de bloque, así que cada
+    bloque de salida se escribe completo una sola vez.
+    """
+    r = _radio_suavizado(smooth)
+    with rasterio.open(band_nir_path) as nir_src, rasterio.open(band_red_path) as red_src:
+        full = Window(0, 0, nir_src.width, nir_src.height)
+        red_full = Window(0, 0, red_src.width, red_src.height)
+        doble = _es_rejilla_doble(nir_src, red_src)
+        with rasterio.open(output_path, 'w', **_perfil_ndvi(nir_src)) as dst:
+            alto = dst.block_shapes[0][0] * _FRANJA_BLOQUES
+            for row_off in range(0, dst.height, alto):
+                win = Window(0, row_off, dst.width, min(alto, dst.height - row_off))
+                halo = Window(
+                    win.col_off - r, win.row_off - r, win.width + 2 * r, win.height + 2 * r
+                ).intersection(full)
+                nir_data = nir_src.read(1, window=halo).astype('float32')
+
+                # Reescalado de la banda RED con interpolación cúbica (mayor calidad)
+                if doble:
+                    # Píxeles RED que cubren el halo, más 2 de margen para el núcleo cúbico
+                    r0 = halo.row_off // 2 - 2
+                    c0 = halo.col_off // 2 - 2
+                    red_win = Window(
+                        c0, r0,
+                        (halo.col_off + halo.width + 1) // 2 + 2 - c0,
+                        (halo.row_off + halo.height + 1) // 2 + 2 - r0
+                    ).intersection(red_full)
+                    red_raw = _banda_kernel(red_src.read(1, window=red_win))
+                    red_data = np.empty(nir_data.shape, dtype=np.float32)
+                    _upsample2x_cubic(
+                        red_raw, red_data,
+                        halo.row_off - 2 * red_win.row_off, halo.col_off - 2 * red_win.col_off
+                    )
+                else:
+                    red_win = from_bounds(*window_bounds(halo, nir_src.transform), transform=red_src.transform)
+                    red_data = red_src.read(
+                        1, window=red_win, out_shape=nir_data.shape, resampling=Resampling.cubic
+                    ).astype('float32')
+
+                block = _ndvi_suavizado(nir_data, red_data, smooth)
+
+                y = win.row_off - halo.row_off
+                x = win.col_off - halo.col_off
+                dst.write(_escalar_ndvi(block[y:y + win.height, x:x + win.width]), 1, window=win)
+            _agregar_overviews(dst)
+
+def guardar_ndvi(ndvi_array, profile, output_path):
+    """Guarda el NDVI en un archivo GeoTIFF"""
+    if profile['dtype'] == 'int16' and ndvi_array.dtype != np.int16:
+        ndvi_array = _escalar_ndvi(ndvi_array)
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        dst.write(ndvi_array, 1)
+        _agregar_overviews(dst)
+
+_VRT_DTYPES = {"int16": "Int16", "uint16": "UInt16", "float32": "Float32", "float64": "Float64"}
+
+def construir_vrt(ndvi_files, output_path):
+    """
+    Escribe un mosaico VRT (equivalente a gdalbuildvrt) que referencia los NDVI por tile.
+    Los lectores posteriores (p. ej. el recorte por estado) solo leen los bloques que necesitan.
+    En zonas solapadas prevalece el primer tile, igual que rasterio.merge.
+    """
+    sources = []
+    for fp in ndvi_files:
+        with rasterio.open(fp) as src:
+            if sources and src.crs != sources[0]["crs"]:
+                print(f"✗ {fp} tiene otro CRS ({src.crs}); se omite del mosaico")
+                continue
+            sources.append({
+                "path": fp, "crs": src.crs, "bounds": src.bounds, "res": src.res,
+                "width": src.width, "height": src.height, "dtype": src.dtypes[0],
+                "nodata": src.nodata, "block": src.block_shapes[0],
+            })
+
+    ref = sources[0]
+    res_x, res_y = ref["res"]
+    left = min(s["bounds"].left for s in sources)
+    bottom = min(s["bounds"].bottom for s in sources)
+    right = max(s["bounds"].right for s in sources)
+    top = max(s["bounds"].top for s in sources)
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+
+    root = ET.Element("VRTDataset", rasterXSize=str(width), rasterYSize=str(height))
+    ET.SubElement(root, "SRS").text = ref["crs"].to_wkt()
+    ET.SubElement(root, "GeoTransform").text = ", ".join(
+        repr(v) for v in (left, res_x, 0.0, top, 0.0, -res_y))
+    band = ET.SubElement(root, "VRTRasterBand", dataType=_VRT_DTYPES[ref["dtype"]], band="1")
+    if ref["nodata"] is not None:
+        ET.SubElement(band, "NoDataValue").text = repr(ref["nodata"])
+
+    vrt_dir = os.path.dirname(os.path.abspath(output_path))
+    # En un VRT la última fuente se pinta encima: se listan en orden inverso
+    for s in reversed(sources):
+        fuente = ET.SubElement(band, "ComplexSource")
+        ET.SubElement(fuente, "SourceFilename", relativeToVRT="1").text = \
+            os.path.relpath(os.path.abspath(s["path"]), vrt_dir)
+        ET.SubElement(fuente, "SourceBand").text = "1"
+        ET.SubElement(fuente, "SourceProperties", RasterXSize=str(s["width"]),
+                      RasterYSize=str(s["height"]), DataType=_VRT_DTYPES[s["dtype"]],
+                      BlockYSize=str(s["block"][0]), BlockXSize=str(s["block"][1]))
+        ET.SubElement(fuente, "SrcRect", xOff="0", yOff="0",
+                      xSize=str(s["width"]), ySize=str(s["height"]))
+        ET.SubElement(fuente, "DstRect",
+                      xOff=repr((s["bounds"].left - left) / res_x),
+                      yOff=repr((top - s["bounds"].top) / res_y),
+                      xSize=repr(s["width"] * s["res"][0] / res_x),
+                      ySize=repr(s["height"] * s["res"][1] / res_y))
+        if s["nodata"] is not None:
+            ET.SubElement(fuente, "NODATA").text = repr(s["nodata"])
+
+    ET.ElementTree(root).write(output_path, encoding="utf-8")
+    return output_path
+
+def construir_mosaico_tif(ndvi_files, output_path, bloque=512):
+    """
+    Escribe el mosaico como GeoTIFF bloque a bloque, sin cargarlo completo en memoria.
+    En zonas solapadas prevalece el primer tile, igual que rasterio.merge.
+    """
+    # ExitStack cierra todos los tiles al salir, también si la escritura falla
+    with ExitStack() as stack:
+        fuentes = []
+        for fp in ndvi_files:
+            src = stack.enter_context(rasterio.open(fp))
+            if fuentes and src.crs != fuentes[0].crs:
+                print(f"✗ {fp} tiene otro CRS ({src.crs}); se omite del mosaico")
+                continue
+            fuentes.append(src)
+
+        res_x, res_y = fuentes[0].res
+        left = min(src.bounds.left for src in fuentes)
+        bottom = min(src.bounds.bottom for src in fuentes)
+        right = max(src.bounds.right for src in fuentes)
+        top = max(src.bounds.top for src in fuentes)
+
+        profile = fuentes[0].profile.copy()
         profile.update({
             'driver': 'GTiff',
-            'dtype': 'float32',
+            'width': int(round((right - left) / res_x)),
+            'height': int(round((top - bottom) / res_y)),
+            'transform': from_origin(left, top, res_x, res_y),
             'count': 1,
-            'compress': 'lzw',
             'tiled': True,
-            'blockxsize': 256,
-            'blockysize': 256
+            'blockxsize': bloque,
+            'blockysize': bloque,
+            'BIGTIFF': 'IF_SAFER'
         })
+        nodata = profile['nodata']
 
-        return ndvi, profile
+        # Ventana de cada tile dentro del mosaico
+        destinos = [
+            from_bounds(*src.bounds, transform=profile['transform']).round_offsets().round_lengths()
+            for src in fuentes
+        ]
 
-def guardar_ndvi(ndvi_array, profile, output_path):
-    """Guarda el NDVI en un archivo GeoTIFF"""
-    with rasterio.open(output_path, 'w', **profile) as dst:
-        dst.write(ndvi_array, 1)
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            # Cada bloque de salida se compone en memoria y se escribe una sola vez
+            for _, win in dst.block_windows(1):
+                data = np.full((win.height, win.width), nodata, dtype=profile['dtype'])
+                for src, destino in zip(fuentes, destinos):
+                    try:
+                        comun = win.intersection(destino)
+                    except WindowError:
+                        continue
+                    src_win = Window(
+                        comun.col_off - destino.col_off, comun.row_off - destino.row_off,
+                        comun.width, comun.height
+                    )
+                    y = comun.row_off - win.row_off
+                    x = comun.col_off - win.col_off
+                    parte = data[y:y + comun.height, x:x + comun.width]
+                    # Solo se rellenan los píxeles que ningún tile anterior ha escrito
+                    libre = parte == nodata
+                    parte[libre] = src.read(1, window=src_win)[libre]
+                dst.write(data, 1, window=win)
+            _agregar_overviews(dst)
+    return output_path
 
-def procesar_ndvi_por_tiles(organized_bands, output_folder="NDVI_output"):
+def _process_one_tile(tile_id, info, output_folder, smooth='gauss'):
+    """Calcula el NDVI de un tile; devuelve la ruta generada o None"""
+    bands = info["bands"]
+    if "B08" in bands and "B04" in bands:
+        output_path = os.path.join(output_folder, f"{tile_id}_NDVI.tif")
+        # Los procesos del pool no heredan el rasterio.Env del hilo que los lanza
+        with rasterio.Env(**GDAL_OPCIONES):
+            calcular_ndvi_por_bloques(bands["B08"], bands["B04"], output_path, smooth)
+        print(f"✓ NDVI calculado para tile {tile_id} → {output_path}")
+        return output_path
+    print(f"✗ Tile {tile_id} no tiene ambas bandas necesarias")
+    return None
+
+def procesar_ndvi_por_tiles(organized_bands, output_folder="NDVI_output", formato_mosaico="vrt", smooth='gauss'):
     """
     Recorre los tiles extraídos por el CopernicusDownloader y calcula el NDVI de cada uno.
-    También puede unir los NDVI en un solo mosaico si hay más de uno.
+    También puede unir los NDVI en un solo mosaico si hay más de uno: 'vrt' (virtual)
+    o 'tif' (GeoTIFF escrito por ventanas). smooth: 'gauss', 'box' o None.
     """
     os.makedirs(output_folder, exist_ok=True)
     ndvi_files = []
 
-    for tile_id, info in organized_bands.items():
-        bands = info["bands"]
-        if "B08" in bands and "B04" in bands:
-            ndvi, profile = calcular_ndvi(bands["B08"], bands["B04"])
-
-            output_path = os.path.join(output_folder, f"{tile_id}_NDVI.tif")
-            guardar_ndvi(ndvi, profile, output_path)
-            ndvi_files.append(output_path)
-            print(f"✓ NDVI calculado para tile {tile_id} → {output_path}")
-        else:
-            print(f"✗ Tile {tile_id} no tiene ambas bandas necesarias")
+    # Cada tile es independiente: se procesan en paralelo, uno por proceso.
+    # 'spawn' en lugar de fork: el proceso padre ya tiene hilos (GUI, Numba) y los
+    # núcleos compilados se cargan de la caché en disco en cada proceso nuevo
+    if organized_bands:
+        with ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(organized_bands)),
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(_process_one_tile, tile_id, info, output_folder, smooth)
+                for tile_id, info in organized_bands.items()
+            ]
+            # Conservar el orden de los tiles para que el mosaico sea reproducible
+            ndvi_files = [path for path in (f.result() for f in futures) if path]
 
-    # Unir NDVIs si hay más de uno
+    # Unir NDVIs si hay más de uno (mosaico virtual: no se copia ningún píxel)
     if len(ndvi_files) > 1:
-        sources = [rasterio.open(fp) for fp in ndvi_files]
-        mosaic, out_trans = merge(sources)
-
-        mosaic_profile = sources[0].profile
-        mosaic_profile.update(
-            height=mosaic.shape[1],
-            width=mosaic.shape[2],
-            transform=out_trans,
-            count=1
-        )
-
-        output_mosaic = os.path.join(output_folder, "NDVI_MOSAICO.tif")
-        with rasterio.open(output_mosaic, 'w', **mosaic_profile) as dst:
-            dst.write(mosaic)
-
+        if formato_mosaico == "tif":
+            output_mosaic = construir_mosaico_tif(ndvi_files, os.path.join(output_folder, "NDVI_MOSAICO.tif"))
+        else:
+            output_mosaic = construir_vrt(ndvi_files, os.path.join(output_folder, "NDVI_MOSAICO.vrt"))
         print(f"✓ Mosaico NDVI generado: {output_mosaic}")
     else:
         print("No hay suficientes tiles para mosaico.")
\ No newline at end of file
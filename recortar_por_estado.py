@@ -1,9 +1,16 @@
 import os
+import hashlib
+import pickle
 import zipfile
-import geopandas as gpd
 import rasterio
 import rasterio.mask
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
 import shutil
+import tempfile
+
+# Geometrías de estados ya filtradas y reproyectadas (pickle por estado, CRS y ZIP de origen)
+CACHE_DIR = ".cache"
 
 def descomprimir_shapefile(zip_path, output_dir="shapes"):
     """Descomprime un ZIP de shapefiles"""
@@ -15,64 +22,112 @@ def filtrar_estado(gdf, nombre_estado="TLAXCALA"):
     """Filtra el GeoDataFrame por el nombre del estado"""
     return gdf[gdf['ENTIDAD'].str.upper() == nombre_estado.upper()]
 
+def _recortar(src, geometries, output_path):
+    """Aplica la máscara de geometrías (en el CRS de src) y guarda el recorte"""
+    # Sin rasterio.Env propio: GDAL_CACHEMAX es global al proceso y un Env anidado
+    # reduciría la caché del llamador (GDAL_OPCIONES) durante el recorte
+    out_image, out_transform = rasterio.mask.mask(src, geometries, crop=True, all_touched=False)
+    out_meta = src.meta.copy()
+
+    out_meta.update({
+        "driver": "GTiff",
+        "height": out_image.shape[1],
+        "width": out_image.shape[2],
+        "transform": out_transform
+    })
+
+    with rasterio.open(output_path, "w", **out_meta) as dest:
+        dest.write(out_image)
+        # Overviews internos para que la visualización no lea la resolución completa
+        dest.build_overviews([2, 4, 8, 16], Resampling.average)
+        dest.update_tags(ns="rio_overview", resampling="average")
+
+    print(f"✓ Recorte guardado en: {output_path}")
+
 def recortar_raster_con_shapefile(raster_path, shapefile_path, output_path):
     """Recorta un raster usando un shapefile y guarda la salida"""
-    gdf = gpd.read_file(shapefile_path)
+    import geopandas as gpd
+    recortar_raster_con_gdf(raster_path, gpd.read_file(shapefile_path), output_path)
 
+def recortar_raster_con_gdf(raster_path, gdf, output_path):
+    """Recorta un raster con las geometrías de un GeoDataFrame ya cargado"""
     # Asegurar CRS compatible
     with rasterio.open(raster_path) as src:
         if gdf.crs != src.crs:
             gdf = gdf.to_crs(src.crs)
 
-        geometries = gdf.geometry.values
-        out_image, out_transform = rasterio.mask.mask(src, geometries, crop=True)
-        out_meta = src.meta.copy()
+        _recortar(src, gdf.geometry.values, output_path)
 
-        out_meta.update({
-            "driver": "GTiff",
-            "height": out_image.shape[1],
-            "width": out_image.shape[2],
-            "transform": out_transform
-        })
-
-        with rasterio.open(output_path, "w", **out_meta) as dest:
-            dest.write(out_image)
-
-    print(f"✓ Recorte guardado en: {output_path}")
+def recortar_con_geom(geometries, raster_path, output_path):
+    """Recorta un raster con geometrías ya expresadas en su CRS"""
+    with rasterio.open(raster_path) as src:
+        _recortar(src, geometries, output_path)
 
-def recortar_ndvi_con_tlaxcala(zip_shapefile, ndvi_path, salida_path="NDVI_TLAXCALA.tif"):
-    """Proceso completo"""
+def _leer_estado(zip_shapefile, nombre_estado):
+    """Lee el shapefile nacional del ZIP y devuelve solo el estado pedido"""
+    import geopandas as gpd
     tmp_dir = "shapefile_tmp"
 
-    # Paso 1: Descomprimir shapefile
+    # Descomprimir y buscar archivo .shp
     descomprimir_shapefile(zip_shapefile, tmp_dir)
-
-    # Paso 2: Buscar archivo .shp
     shp_files = [f for f in os.listdir(tmp_dir) if f.endswith(".shp")]
     if not shp_files:
         raise FileNotFoundError("No se encontró ningún .shp en el ZIP")
     shp_path = os.path.join(tmp_dir, shp_files[0])
 
-    # Paso 3: Filtrar Tlaxcala
     gdf = gpd.read_file(shp_path)
-    gdf_tlaxcala = filtrar_estado(gdf, "TLAXCALA")
-
-    if gdf_tlaxcala.empty:
-        raise ValueError("No se encontró el estado TLAXCALA en el shapefile")
+    gdf_estado = filtrar_estado(gdf, nombre_estado)
 
-    # Paso 4: Guardar shapefile filtrado (opcional)
-    tlax_path = os.path.join(tmp_dir, "tlaxcala.shp")
-    gdf_tlaxcala.to_file(tlax_path)
+    if gdf_estado.empty:
+        raise ValueError(f"No se encontró el estado {nombre_estado} en el shapefile")
 
-    # Paso 5: Recortar raster
-    recortar_raster_con_shapefile(ndvi_path, tlax_path, salida_path)
-
-    # Limpieza opcional
+    # Limpieza
     shutil.rmtree(tmp_dir)
+    return gdf_estado
+
+def obtener_geometria_estado(zip_shapefile, crs, nombre_estado="TLAXCALA"):
+    """
+    Geometrías del estado reproyectadas a crs. Se guardan en CACHE_DIR con una clave
+    que identifica el ZIP (ruta, tamaño y mtime): otro ZIP, o el mismo modificado,
+    vuelve a leer el shapefile nacional.
+    """
+    crs = CRS.from_user_input(crs)
+    epsg = crs.to_epsg()
+    crs_tag = f"epsg{epsg}" if epsg else hashlib.sha1(crs.to_wkt().encode()).hexdigest()[:12]
+    st = os.stat(zip_shapefile)
+    zip_tag = hashlib.sha1(
+        f"{os.path.abspath(zip_shapefile)}|{st.st_size}|{st.st_mtime_ns}".encode()
+    ).hexdigest()[:12]
+    cache_path = os.path.join(CACHE_DIR, f"{nombre_estado.lower()}_{crs_tag}_{zip_tag}.pkl")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    geometries = list(_leer_estado(zip_shapefile, nombre_estado).to_crs(crs).geometry.values)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Escritura en un temporal y renombrado: un corte a medias no deja un pickle truncado
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(geometries, f)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return geometries
+
+def recortar_ndvi_con_tlaxcala(zip_shapefile, ndvi_path, salida_path="NDVI_TLAXCALA.tif"):
+    """Proceso completo: geometría de Tlaxcala (en caché) en el CRS del NDVI y recorte"""
+    with rasterio.open(ndvi_path) as src:
+        crs = src.crs
+    recortar_con_geom(obtener_geometria_estado(zip_shapefile, crs, "TLAXCALA"), ndvi_path, salida_path)
 
 # ▶️ Ejemplo de uso
 if __name__ == "__main__":
     zip_shp = "Estados_Mexico.zip"             # ← Cambia si tu ZIP tiene otro nombre
-    ndvi_tif = "NDVI_output/NDVI_MOSAICO.tif"   # ← O cualquier TIFF de entrada
+    ndvi_tif = "NDVI_output/NDVI_MOSAICO.vrt"   # ← O cualquier TIFF de entrada
     salida = "NDVI_TLAXCALA.tif"
-    recortar_ndvi_con_tlaxcala(zip_shp, ndvi_tif, salida)
+    from ndvi_processor import GDAL_OPCIONES
+    with rasterio.Env(**GDAL_OPCIONES):
+        recortar_ndvi_con_tlaxcala(zip_shp, ndvi_tif, salida)
@@ -1,28 +1,62 @@
 import rasterio
-import matplotlib.pyplot as plt
 import numpy as np
+from rasterio.enums import Resampling
+from ndvi_processor import NDVI_ESCALA
 from tkinter import filedialog, messagebox
-import matplotlib
-from io import BytesIO
-from docx import Document
-from docx.shared import Inches
 import tempfile
 import os
 
-def visualizar_ndvi(ndvi_path, fecha_inicio, fecha_fin):
+# Alto máximo (px) del raster a dibujar: ~3000×2400 basta para la figura a 300 dpi
+ALTO_VISTA = 2400
+
+def visualizar_ndvi(ndvi_path, fecha_inicio, fecha_fin, salida_png=None):
+    """
+    Muestra el NDVI recortado. Con salida_png la figura se guarda en ese archivo sin
+    abrir ninguna ventana (apto para hilos de trabajo).
+    """
+    # matplotlib y python-docx se importan al usarse: cargarlos retrasa el arranque de la GUI
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+
     with rasterio.open(ndvi_path) as src:
-        ndvi = src.read(1)
+        # Lectura reducida al tamaño de la figura (usa los overviews internos si existen)
+        factor = max(1, src.height // ALTO_VISTA)
+        datos = src.read(
+            1, out_shape=(src.height // factor, src.width // factor), resampling=Resampling.average
+        )
 
-        ndvi = np.where((ndvi >= -1.0) & (ndvi <= 1.0), ndvi, np.nan)
+        # Máscara de valores inválidos escrita en sitio, sin arrays temporales de np.where
+        if src.dtypes[0] == 'int16':
+            # NDVI guardado como int16 escalado por NDVI_ESCALA: la máscara es una
+            # comparación entera (sin np.abs, que desborda con -32768)
+            invalido = (datos < -NDVI_ESCALA) | (datos > NDVI_ESCALA)
+            if src.nodata is not None:
+                invalido |= datos == src.nodata
+            ndvi = datos.astype('float32')
+            ndvi *= 1.0 / NDVI_ESCALA
+        else:
+            ndvi = datos.astype('float32', copy=False)
+            invalido = ~np.isfinite(ndvi)
+            invalido |= np.abs(ndvi) > 1.0
+        ndvi[invalido] = np.nan
 
-        fig, ax = plt.subplots(figsize=(10, 8))
+        if salida_png:
+            # Figura sin backend de pyplot: no bloquea ni toca el bucle de Tk
+            fig = Figure(figsize=(10, 8))
+            ax = fig.subplots()
+        else:
+            fig, ax = plt.subplots(figsize=(10, 8))
         p2, p98 = np.nanpercentile(ndvi, (2, 98))
         cmap = plt.cm.YlGn
         im = ax.imshow(ndvi, cmap=cmap, vmin=p2, vmax=p98)
-        plt.colorbar(im, ax=ax, label='NDVI')
-        plt.title(f"NDVI Recortado \nPeriodo: {fecha_inicio} a {fecha_fin}")
-        plt.axis('off')
-        plt.tight_layout()
+        fig.colorbar(im, ax=ax, label='NDVI')
+        ax.set_title(f"NDVI Recortado \nPeriodo: {fecha_inicio} a {fecha_fin}")
+        ax.axis('off')
+        fig.tight_layout()
+
+        if salida_png:
+            fig.savefig(salida_png, dpi=300)
+            return salida_png
 
         def guardar_imagen(event):
             result = messagebox.askyesno("Guardar imagen", "¿Deseas guardar esta imagen?")
@@ -48,6 +82,8 @@ def visualizar_ndvi(ndvi_path, fecha_inicio, fecha_fin):
                 messagebox.showinfo("Guardado", f"Imagen guardada en {filepath}")
 
             elif ext == ".docx":
+                from docx import Document
+                from docx.shared import Inches
                 with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_img:
                     fig.savefig(tmp_img.name, dpi=300)
                     tmp_img.flush()